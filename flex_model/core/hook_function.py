@@ -1,7 +1,8 @@
 import logging
+import os
 from argparse import Namespace
 from functools import partial
-from typing import Any, Callable, Optional, Tuple, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import torch
 import torch.nn as nn
@@ -17,8 +18,122 @@ from flex_model.traverse import (
 )
 
 LayerOutputs = Union[InternalObject, LeafObject, ScalarObject]
+BufferKey = Tuple[Tuple[int, ...], torch.dtype, torch.device]
 logger = logging.getLogger(__name__)
 
+# Validate that editing functions preserve the activation shape. Disabled by
+# default since the check runs on every hook function invocation.
+_DEBUG_SHAPES = bool(int(os.environ.get("FLEX_MODEL_DEBUG_SHAPES", "0")))
+
+# Upper bounds on the number of released buffers kept for reuse. Pinned
+# memory is not returned to the OS until the buffers are freed, so buffers
+# beyond these are dropped instead of pooled.
+_MAX_POOLED_BUFFERS_PER_KEY = 32
+_MAX_POOLED_BUFFERS = 128
+
+
+class _BufferPool:
+    """Pool of offloaded activation buffers, shared by all hook functions of a
+    :class:`FlexModel` instance.
+
+    Buffers are keyed by shape, dtype and device, so any hook function can
+    reuse a buffer released by another.
+
+    :param int max_buffers_per_key: Maximum number of buffers kept for each
+        shape, dtype and device.
+    :param int max_buffers: Maximum number of buffers kept in total.
+    """
+
+    def __init__(
+        self,
+        max_buffers_per_key: int = _MAX_POOLED_BUFFERS_PER_KEY,
+        max_buffers: int = _MAX_POOLED_BUFFERS,
+    ):
+        self.max_buffers_per_key = max_buffers_per_key
+        self.max_buffers = max_buffers
+        self._buffers: Dict[BufferKey, List[Tensor]] = {}
+        self._num_buffers = 0
+
+    def __len__(self) -> int:
+        return self._num_buffers
+
+    @staticmethod
+    def _key(
+        tensor: Tensor, device: Optional[torch.device] = None
+    ) -> BufferKey:
+        """Key of a buffer in the pool.
+
+        :param Tensor tensor: Tensor matching the buffer shape and dtype.
+        :param device: Device of the buffer. Defaults to the tensor device.
+        :type device: Optional[torch.device]
+
+        :returns: The buffer key.
+        :rtype: BufferKey
+        """
+        return (
+            tuple(tensor.shape),
+            tensor.dtype,
+            tensor.device if device is None else device,
+        )
+
+    def get_pinned(self, activation: Tensor) -> Tensor:
+        """Get a pinned CPU buffer matching the activation shape and dtype.
+
+        :param Tensor activation: Activation tensor to be offloaded.
+
+        :returns: A pooled pinned CPU buffer if available, else a newly
+            allocated one.
+        :rtype: Tensor
+        """
+        buffers = self._buffers.get(self._key(activation, torch.device("cpu")))
+        if buffers:
+            self._num_buffers -= 1
+            return buffers.pop()
+        return torch.empty(
+            activation.shape, dtype=activation.dtype, pin_memory=True
+        )
+
+    def get_like(self, activation: Tensor) -> Tensor:
+        """Get a buffer on the activation's device matching its shape and dtype.
+
+        :param Tensor activation: Activation tensor to be offloaded.
+
+        :returns: A pooled buffer if available, else a newly allocated one.
+        :rtype: Tensor
+        """
+        buffers = self._buffers.get(self._key(activation))
+        if buffers:
+            self._num_buffers -= 1
+            return buffers.pop()
+        return torch.empty_like(activation)
+
+    def put(self, buffers: List[Tensor]) -> None:
+        """Return offloaded activation buffers to the pool.
+
+        :note: Only CUDA and pinned CPU buffers are pooled, other tensors are
+            dropped. Buffers beyond the pool limits are dropped too.
+
+        :note: The caller must not use the buffers after returning them, since
+            they will be overwritten by subsequent offloads.
+
+        :param List[Tensor] buffers: Offloaded activation tensors.
+        """
+        for buf in buffers:
+            if self._num_buffers >= self.max_buffers:
+                break
+            if not (buf.is_cuda or buf.is_pinned()):
+                continue
+
+            pooled = self._buffers.setdefault(self._key(buf), [])
+            if len(pooled) < self.max_buffers_per_key:
+                pooled.append(buf)
+                self._num_buffers += 1
+
+    def clear(self) -> None:
+        """Drop all pooled buffers."""
+        self._buffers.clear()
+        self._num_buffers = 0
+
 
 def _parse_editing_function(edit_function: Callable) -> Callable:
     """Parse the user-provided editing function.
@@ -63,6 +178,15 @@ def default_editing_function(
     return inputs
 
 
+def _repack_tensor(edited_tensor: Tensor) -> Tensor:
+    """Repack function for layer outputs which are a bare tensor."""
+    return edited_tensor
+
+
+def _skip_offload(activation: Tensor) -> None:
+    """Offload function for ranks which don't keep activations."""
+
+
 class HookFunction:
     """Function which retrieves/edits activations in a Pytorch `nn.Module`.
 
@@ -83,6 +207,8 @@ class HookFunction:
         save context and trainable modules are available for use in the
         editing function runtime.
     :type editing_function: Optional[Callable]
+    :var bool compile_editing_function: Compile the :code:`editing_function`
+        with :code:`torch.compile` to fuse operations on the activation tensor.
     :var save_ctx: Global save context that is exposed to the
         :code:`editing_function`.
     :type save_ctx: Optional[Namespace]
@@ -125,12 +251,40 @@ class HookFunction:
         )
     """
 
+    # Models may have hundreds of hooked submodules, so avoid carrying a
+    # per-instance __dict__.
+    __slots__ = (
+        "module_name",
+        "expected_shape",
+        "editing_function",
+        "unpack_idx",
+        "compile_editing_function",
+        "_shared_state",
+        "_hook_type",
+        "_dispatch_impl",
+        "_collect",
+        "_disperse",
+        "_edit",
+        "_offload",
+        "_concretized",
+    )
+
+    # Valid hook function implementations, resolved on hook registration.
+    _HOOK_IMPL_NAMES = {
+        "forward": "_forward_hook_impl",
+        "full_backward": "_full_backward_hook_impl",
+        "tensor": "_tensor_hook_impl",
+        "forward_pre": "_forward_pre_hook_impl",
+        "full_backward_pre": "_full_backward_pre_hook_impl",
+    }
+
     def __init__(
         self,
         module_name: str,
         expected_shape: Tuple[Optional[int], ...],
         editing_function: Optional[Callable] = None,
         unpack_idx: int = 0,
+        compile_editing_function: bool = False,
     ) -> None:
         """Initializes the instance by wrapping the :code:`editing_function`.
 
@@ -139,7 +293,9 @@ class HookFunction:
         :param expected_shape: Shape of the full activation tensor.
         :type expected_shape: Tuple[Optional[int], ...]
         :param editing_function: Function which edits the activation
-            tensor.
+            tensor. If the :class:`FlexModel` instance uses
+            :code:`async_offload`, it must not modify the activation tensor
+            in-place, since the offload copy may still be reading it.
         :type editing_function: Optional[Callable]
         :param str hook_type: Type of hook to register, eg. forward, backward,
             etc.
@@ -149,6 +305,10 @@ class HookFunction:
             by recursive unpacking. Hence the `unpack_idx` parameter allows
             for specification of which tensor to consider the activation
             tensor for downstream processing in the `HookFunction`.
+        :param bool compile_editing_function: If true, compile the editing
+            function with :code:`torch.compile` so chains of pointwise ops on
+            the activation tensor can be fused. Falls back to the uncompiled
+            editing function if compilation is not supported or fails.
         """
         # User-provided state.
         self.module_name = module_name
@@ -161,25 +321,19 @@ class HookFunction:
         else:
             self.editing_function = editing_function
         self.unpack_idx = unpack_idx
+        self.compile_editing_function = compile_editing_function
 
         # FM instance registry-provided state.
         self._shared_state = None
         self._hook_type = None
+        self._dispatch_impl: Optional[Callable] = None
 
         # Runtime state.
         self._collect: Optional[Callable] = None
         self._disperse: Optional[Callable] = None
         self._edit: Optional[Callable] = None
         self._offload: Optional[Callable] = None
-
-        # Valid hook function implementations.
-        self.hook_type_to_impl_fn = {
-            "forward": self._forward_hook_impl,
-            "full_backward": self._full_backward_hook_impl,
-            "tensor": self._tensor_hook_impl,
-            "forward_pre": self._forward_pre_hook_impl,
-            "full_backward_pre": self._full_backward_pre_hook_impl,
-        }
+        self._concretized = False
 
     def _unpack_layer_outputs(
         self,
@@ -203,61 +357,121 @@ class HookFunction:
             tensor and a function to undo the unpacking operation.
         :rtype: Tuple[Tensor, partial]
 
+        :note: Bare tensors and flat tuples/lists of tensors are the most
+            common layer outputs, so they are unpacked directly without
+            building a tree definition.
+
         :raises AssertionError: Occurs if no tensor is found at all in the
             layer outputs.
         """
+        unpack_idx = self.unpack_idx
+        outputs_type = type(outputs)
+
+        # Fast path: Bare tensor.
+        if outputs_type is Tensor and unpack_idx == 0:
+            return outputs, _repack_tensor
+
+        # Fast path: Flat tuple or list of tensors.
+        if (outputs_type is tuple or outputs_type is list) and all(
+            type(o) is Tensor for o in outputs
+        ):
+            tensor = outputs[unpack_idx]
+
+            def _repack_sequence(_edited_tensor) -> LayerOutputs:
+                """Pack activation tensor back into the tuple or list."""
+                layer_outputs = list(outputs)
+                layer_outputs[unpack_idx] = _edited_tensor
+                if outputs_type is tuple:
+                    return tuple(layer_outputs)
+                return layer_outputs
+
+            return tensor, _repack_sequence
+
         treedef, leaves = flatten(outputs)
 
-        left_leaves, tensor, right_leaves = (
-            leaves[: self.unpack_idx],
-            leaves[self.unpack_idx],
-            leaves[self.unpack_idx + 1 :],
-        )
+        tensor = leaves[unpack_idx]
         assert tensor is not None
 
         def _repack(_edited_tensor) -> LayerOutputs:
             """Pack activation tensor back into layer output container."""
-            layer_outputs = unflatten(
-                treedef,
-                left_leaves + [_edited_tensor] + right_leaves,
-            )
+            # The leaves list is owned by this hook invocation, so it's safe
+            # to swap the edited tensor in-place.
+            leaves[unpack_idx] = _edited_tensor
+            layer_outputs = unflatten(treedef, leaves)
             return layer_outputs
 
         return tensor, _repack
 
     def _concretize_offload_function(self):
-        # Safe, these don't change dring runtime.
-        using_torch_dist = torch.distributed.is_initialized
-        using_act_dist = dist.activation_parallel_is_initialized
-        in_pp_group = dist.in_pipeline_parallel_group
+        # Safe, the distributed state is set up when the FlexModel instance is
+        # created and torn down only when its hook functions are removed.
+        should_offload = not torch.distributed.is_initialized() or (
+            dist.activation_parallel_is_initialized()
+            and dist.in_pipeline_parallel_group()
+        )
+        if not should_offload:
+            return _skip_offload
+
+        # Shared state is installed at registration and is stable for the
+        # lifetime of the hook function.
+        output_ptr = self._shared_state.output_ptr
+        buffer_pool = self._shared_state.buffer_pool
+        module_name = self.module_name
+        assert output_ptr is not None
+
+        # Only forward pass copies are waited on by the FlexModel instance,
+        # so hooks firing during `.backward()` always copy synchronously.
+        is_forward_hook = self._hook_type in ("forward", "forward_pre")
+        if is_forward_hook:
+            offload_stream = self._shared_state.offload_stream
+            pending_offload_devices = self._shared_state.pending_offload_devices
+        else:
+            offload_stream = None
 
+        # Offloaded copies are never part of the autograd graph.
+        @torch.no_grad()
         def _offload_tensor_to_cpu(activation: Tensor) -> None:
-            assert self._shared_state.output_ptr is not None
-
-            if not using_torch_dist() or (using_act_dist() and in_pp_group()):
-                # Tensor.to() with non_blockin=True operates on shared memory
-                # buffers automatically.
-                if self._shared_state.output_ptr.get(self.module_name, False):
-                    self._shared_state.output_ptr[self.module_name].append(
-                        activation.detach().to("cpu", non_blocking=True)
-                    )
+            detached = activation.detach()
+
+            # D2H copies into pinned memory are faster, and can only be made
+            # asynchronous when the destination is pinned, so copy into a
+            # pooled pinned buffer.
+            if detached.is_cuda:
+                dst = buffer_pool.get_pinned(detached)
+                if offload_stream is not None:
+                    # Overlap the copy with subsequent compute, and keep the
+                    # caching allocator from reusing the activation memory
+                    # until the copy completes. The copy is waited on by the
+                    # FlexModel instance before activations are read.
+                    offload_stream.wait_stream(torch.cuda.current_stream())
+                    detached.record_stream(offload_stream)
+                    with torch.cuda.stream(offload_stream):
+                        dst.copy_(detached, non_blocking=True)
+                elif is_forward_hook:
+                    # Copy on the current stream, which the FlexModel instance
+                    # waits on once after the forward pass.
+                    dst.copy_(detached, non_blocking=True)
+                    pending_offload_devices.add(detached.device)
                 else:
-                    self._shared_state.output_ptr[self.module_name] = [
-                        activation.detach().to("cpu", non_blocking=True)
-                    ]
-
+                    # Nothing waits on the copy later, so it must complete
+                    # before the activation is handed to the user.
+                    dst.copy_(detached)
+            else:
+                dst = detached.to("cpu")
+            activations = output_ptr.get(module_name)
+            if activations is None:
+                activations = output_ptr[module_name] = []
+            activations.append(dst)
+
+        @torch.no_grad()
         def _offload_tensor_to_gpu(activation: Tensor) -> None:
-            assert self._shared_state.output_ptr is not None
-
-            if not using_torch_dist() or (using_act_dist() and in_pp_group()):
-                if self._shared_state.output_ptr.get(self.module_name, False):
-                    self._shared_state.output_ptr[self.module_name].append(
-                        activation.detach().clone()
-                    )
-                else:
-                    self._shared_state.output_ptr[self.module_name] = [
-                        activation.detach().clone()
-                    ]
+            detached = activation.detach()
+            dst = buffer_pool.get_like(detached)
+            dst.copy_(detached)
+            activations = output_ptr.get(module_name)
+            if activations is None:
+                activations = output_ptr[module_name] = []
+            activations.append(dst)
 
         # Valid offload modes.
         mode_to_fn = {
@@ -270,7 +484,36 @@ class HookFunction:
     def _concretize_editing_function(self):
         base_edit_fn = _parse_editing_function(self.editing_function)
 
-        return base_edit_fn
+        if (
+            not self.compile_editing_function
+            or base_edit_fn is default_editing_function
+        ):
+            return base_edit_fn
+
+        try:
+            compiled_edit_fn = torch.compile(base_edit_fn)
+        except RuntimeError as e:
+            logger.warning(
+                f"{self.module_name}: Failed to compile editing function, "
+                f"falling back to eager mode: {e}"
+            )
+            return base_edit_fn
+
+        # Most compilation is deferred until the first call, which is where
+        # backend failures are raised.
+
+        def _edit_with_fallback(*args) -> Tensor:
+            try:
+                return compiled_edit_fn(*args)
+            except torch._dynamo.exc.BackendCompilerFailed as e:
+                logger.warning(
+                    f"{self.module_name}: Failed to compile editing function, "
+                    f"falling back to eager mode: {e}"
+                )
+                self._edit = base_edit_fn
+                return base_edit_fn(*args)
+
+        return _edit_with_fallback
 
     def _concretize_functions(self, tensor: Tensor) -> None:
         """Runs parsers for collection/dispersion, editing and dumping.
@@ -281,45 +524,24 @@ class HookFunction:
             2. The shape of the (potentially sharded) activation tensor
             3. The expected shape of the full activation tensor.
 
+        :note: No-op collection and dispersion functions are left as
+            :code:`None` so they can be skipped entirely at runtime.
+
         :param Tensor tensor: (Potentially sharded) activation tensor to parse.
         """
-        (
-            self._collect,
-            self._disperse,
-        ) = dist.parse_collect_and_distribute_from_tensor(
+        collect_fn, disperse_fn = dist.parse_collect_and_distribute_from_tensor(
             tensor,
             self.expected_shape,
         )
+        self._collect = None if collect_fn is dist.unity else collect_fn
+        self._disperse = None if disperse_fn is dist.unity else disperse_fn
         self._edit = self._concretize_editing_function()
         self._offload = self._concretize_offload_function()
 
-    def _dispatch_hook_function(
-        self,
-        hook_function_args: Tuple[Any, ...],
-    ) -> Union[LayerOutputs, Tensor]:
-        """Dispatches the correct handling function depending on the hook type.
-
-        There are many different types of Pytorch hooks with varying function
-        signatures. This function unpacks the Pytorch hook function input
-        arguments depending on the hook type and dispatches the corresponding
-        handling function.
-
-        :note: The unpacking here is in constrast to the unpacking of layer
-            outputs, which is done in the next step if needed.
-
-        :returns: Potentially edited layer outputs.
-            These outputs are sent as input to the next layer.
-        :rtype: Union[LayerOutputs, Tensor]
-
-        :raise NotImplementedError: The requested hook type isn't yet
-            supported.
-        """
-        logger.debug(f"*{self.module_name}: Hook function activated*")
-
-        handle_fn = self.hook_type_to_impl_fn[self._hook_type]
-        retval = handle_fn(*hook_function_args)
-
-        return retval
+        assert self._edit is not None and self._offload is not None, (
+            "HookFunction runtime functions are only partially defined. "
+            "Crashing since HookFunction may be corrupted."
+        )
 
     def _forward_hook_impl(
         self,
@@ -357,7 +579,7 @@ class HookFunction:
     ) -> Union[LayerOutputs, Tensor]:
         """Runs a hook function for editing forward module inputs."""
         # Same procedure as `_handle_forward`, just that we operate on args.
-        outputs = self._template_layer_outputs(module, args)
+        outputs = self._template_handle_layer_outputs(module, args)
         return outputs
 
     def _full_backward_pre_hook_impl(
@@ -366,7 +588,7 @@ class HookFunction:
         grad_outputs: Union[LayerOutputs, Tensor],
     ) -> Union[LayerOutputs, Tensor]:
         """Runs a hook function for editing backward module output gradients."""
-        outputs = self._template_layer_outputs(module, grad_outputs)
+        outputs = self._template_handle_layer_outputs(module, grad_outputs)
         return outputs
 
     def _template_handle_tensor(
@@ -376,28 +598,21 @@ class HookFunction:
 
         This function is used alone in cases where hook functions operate
         directly on a tensor, and not an entire module.
+
+        :note: Set the :code:`FLEX_MODEL_DEBUG_SHAPES=1` environment variable
+            to validate that the editing function preserves the activation
+            tensor shape.
         """
-        start_shape = tensor.shape
+        if _DEBUG_SHAPES:
+            start_shape = tensor.shape
 
         # Concretize functions.
-        fns_to_check = [
-            self._collect,
-            self._disperse,
-            self._edit,
-            self._offload,
-        ]
-        fns_are_undefined = [fn is None for fn in fns_to_check]
-        if all(fns_are_undefined):
+        if not self._concretized:
             self._concretize_functions(tensor)
-        elif not all(fns_are_undefined):
-            pass
-        else:
-            raise Exception(
-                "HookFunction runtime functions are only partially defined. "
-                "Crashing since HookFunction may be corrupted."
-            )
+            self._concretized = True
 
-        tensor = self._collect(tensor)
+        if self._collect is not None:
+            tensor = self._collect(tensor)
 
         self._offload(tensor)
 
@@ -408,13 +623,15 @@ class HookFunction:
             self._shared_state.modules,
         )
 
-        tensor = self._disperse(tensor)
+        if self._disperse is not None:
+            tensor = self._disperse(tensor)
 
-        assert start_shape == tensor.shape, (
-            f"Input tensor and output tensor shape mismatch: {start_shape} -> "
-            f"{tensor.shape}. The tensor returned by the editing function must "
-            f"not change in shape at the output."
-        )
+        if _DEBUG_SHAPES:
+            assert start_shape == tensor.shape, (
+                f"Input tensor and output tensor shape mismatch: {start_shape} "
+                f"-> {tensor.shape}. The tensor returned by the editing "
+                f"function must not change in shape at the output."
+            )
 
         return tensor
 
@@ -448,17 +665,48 @@ class HookFunction:
 
         return edited_inputs_or_outputs
 
+    def _bind_hook_type(self, hook_type: str) -> None:
+        """Set the hook type and resolve the corresponding handling function.
+
+        There are many different types of Pytorch hooks with varying function
+        signatures. The handling function which unpacks the Pytorch hook
+        function input arguments is resolved once here, since the hook type
+        is fixed after registration.
+
+        :param str hook_type: Type of hook being registered, eg. forward,
+            full_backward, etc.
+
+        :raises NotImplementedError: The requested hook type isn't yet
+            supported.
+        """
+        if hook_type not in self._HOOK_IMPL_NAMES:
+            raise NotImplementedError(
+                f"HookFunction doesn't support hook type: {hook_type}"
+            )
+        self._hook_type = hook_type
+        self._dispatch_impl = getattr(self, self._HOOK_IMPL_NAMES[hook_type])
+
     def __call__(self, *args, **kwargs) -> LayerOutputs:
         """Entrypoint called by Pytorch hook logic.
 
         Allows us to bind the entire :class:`HookFunction` to an :code:`nn.Module`
-        using Pytorch hook registration.
+        using Pytorch hook registration. Dispatches to the handling function
+        resolved for this hook type during registration.
+
+        :note: The unpacking here is in constrast to the unpacking of layer
+            outputs, which is done in the next step if needed.
 
         :note: Doesn't currently support accepting keyword argments passed into
             :code:`nn.Module`s.
+
+        :returns: Potentially edited layer outputs.
+            These outputs are sent as input to the next layer.
+        :rtype: Union[LayerOutputs, Tensor]
         """
         if len(kwargs) != 0:
             raise NotImplementedError("HookFunction doesn't support kwargs.")
 
-        outputs = self._dispatch_hook_function(args)
-        return outputs
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"*{self.module_name}: Hook function activated*")
+
+        return self._dispatch_impl(*args)
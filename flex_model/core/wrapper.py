@@ -3,7 +3,7 @@ import logging
 import weakref
 from argparse import Namespace
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import (
     Any,
     Callable,
@@ -22,7 +22,7 @@ from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
 
 import flex_model.distributed as dist
 
-from .hook_function import HookFunction
+from .hook_function import HookFunction, _BufferPool
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +45,9 @@ class _SharedState:
     save_ctx: Namespace
     modules: nn.ModuleDict
     offload_mode: str
+    offload_stream: Optional[torch.cuda.Stream] = None
+    buffer_pool: _BufferPool = field(default_factory=_BufferPool)
+    pending_offload_devices: Set[torch.device] = field(default_factory=set)
 
 
 class _HookFunctionGroupManager:
@@ -231,6 +234,7 @@ def _finalize_dangling_state(
         Union[nn.Module, Tensor],
         Dict[HookFunction, torch.utils.hooks.RemovableHandle],
     ],
+    buffer_pool: _BufferPool,
 ) -> None:
     """Clear persistent state when FlexModel is garbage collected."""
     # Remove hook functions from model.
@@ -239,6 +243,9 @@ def _finalize_dangling_state(
             handle.remove()
     hook_functions.clear()
 
+    # Free pooled offload buffers, which no hook function will reuse.
+    buffer_pool.clear()
+
     # Clear distributed states.
     if dist.distributed_backend_is_initialized():
         if dist.activation_parallel_is_initialized():
@@ -281,6 +288,8 @@ class FlexModel(nn.Module):
     :var int dp_size: Data parallel dimension size.
     :var int offload_mode: Selected device which activation tensors are
         offloaded to.
+    :var bool async_offload: If true, CPU offloading in forward hooks runs on
+        a dedicated CUDA stream to overlap with subsequent model compute.
 
     :note: Calls to `.backward()` should consider calling :code:`wrapped_module_requires_grad(False)`,
         else the gradient will be generated for the entire wrapped model and
@@ -334,6 +343,7 @@ class FlexModel(nn.Module):
         pipeline_parallel_size: int = 1,
         data_parallel_size: int = 1,
         offload_mode: str = "CPU",
+        async_offload: bool = False,
     ):
         """Initialize the instance by wrapping the Pytorch module.
 
@@ -348,12 +358,23 @@ class FlexModel(nn.Module):
             parallel group.
         :param str offload_mode: Device which activation tensors are offloaded
             to. Valid modes are currently "CPU" and "GPU".
+        :param bool async_offload: Run CPU offloading on a dedicated CUDA
+            stream, overlapping device-to-host copies with the rest of the
+            forward pass. The copies are waited on before :code:`forward`
+            returns. Neither editing functions nor the wrapped module may
+            modify hooked activations in-place, since the copy may still be
+            reading them. Hooks which run during :code:`.backward()` always
+            copy synchronously.
         """
         super().__init__()
         self.module = module
 
         self.output_ptr = output_ptr
-        self.save_ctx: Namespace = Namespace()  # dumb Namespace for now
+        # Editing functions store arbitrary user-named attributes here, so the
+        # context must be backed by an instance dict. A slotted class would
+        # need a __getattr__ fallback for those names, which is slower than
+        # plain Namespace attribute access.
+        self.save_ctx: Namespace = Namespace()
         self.trainable_modules = nn.ModuleDict()
         self.tp_size = tensor_parallel_size
         self.pp_size = pipeline_parallel_size
@@ -373,6 +394,13 @@ class FlexModel(nn.Module):
         self._offload_modes = {"CPU", "GPU"}
         assert offload_mode in self._offload_modes
         self.offload_mode = offload_mode
+        self.async_offload = async_offload
+        self._offload_stream = (
+            torch.cuda.Stream()
+            if async_offload and torch.cuda.is_available()
+            else None
+        )
+        self._buffer_pool = _BufferPool()
 
         # Create shared state between FM instance and HF instances.
         self._shared_state = _SharedState(
@@ -380,6 +408,8 @@ class FlexModel(nn.Module):
             self.save_ctx,
             self.trainable_modules,
             self.offload_mode,
+            self._offload_stream,
+            self._buffer_pool,
         )
         self._hook_fn_group_manager = _HookFunctionGroupManager()
 
@@ -389,7 +419,7 @@ class FlexModel(nn.Module):
             "full_backward": "register_full_backward_hook",
             "tensor": "register_hook",
             "forward_pre": "register_forward_pre_hook",
-            "backward_pre": "register_full_backward_pre_hook",
+            "full_backward_pre": "register_full_backward_pre_hook",
         }
         # Map: submodule -> hook functions -> hook handle.
         self._module_to_hook_fns_map: Dict[
@@ -402,6 +432,7 @@ class FlexModel(nn.Module):
             self,
             _finalize_dangling_state,
             self._module_to_hook_fns_map,
+            self._buffer_pool,
         )
 
     def _enable_hooks(self, active_hooks: Set[HookFunction]) -> None:
@@ -447,6 +478,11 @@ class FlexModel(nn.Module):
     ) -> Any:
         """Run a forward pass of the model with all hooks active by default.
 
+        :note: Device-to-host offload copies made by forward hooks are
+            asynchronous, and are waited on before this function returns.
+            Hooks which run outside of this function (ie. during
+            :code:`.backward()`) copy synchronously.
+
         :param groups: `HookFunction` groups to activate during the forward
             pass.
         :type groups: Union[str, List[str]]
@@ -464,6 +500,14 @@ class FlexModel(nn.Module):
 
         outputs = self.module(*args, **kwargs)
 
+        # Wait for in-flight activation offloads to land.
+        if self._offload_stream is not None:
+            self._offload_stream.synchronize()
+        pending_offload_devices = self._shared_state.pending_offload_devices
+        for device in pending_offload_devices:
+            torch.cuda.current_stream(device).synchronize()
+        pending_offload_devices.clear()
+
         # Post-forward cleanup.
         self._flush_pipeline()
 
@@ -506,7 +550,7 @@ class FlexModel(nn.Module):
         assert hook_function._shared_state is None
         assert hook_function._hook_type is None
         hook_function._shared_state = self._shared_state
-        hook_function._hook_type = hook_type
+        hook_function._bind_hook_type(hook_type)
 
         # Pass to registration impl.
         self._register_hook_impl(hook_function)
@@ -642,7 +686,7 @@ class FlexModel(nn.Module):
 
         :param HookFunction hook_function: `HookFunction` instance to register.
         """
-        self._register_hook_prologue(hook_function, "backward_pre")
+        self._register_hook_prologue(hook_function, "full_backward_pre")
 
     def register_trainable_module(self, name: str, module: nn.Module) -> None:
         """Register trainable module accessible to all :class:`HookFunction` instances.
@@ -655,6 +699,22 @@ class FlexModel(nn.Module):
         """
         self.trainable_modules[name] = module
 
+    def release_activations(self) -> None:
+        """Clear the output dictionary and recycle the offloaded buffers.
+
+        Offloaded activations are copied into pooled buffers shared by all
+        :class:`HookFunction` instances. Releasing them allows subsequent
+        forward passes to reuse the buffers instead of allocating new ones.
+        The pool is bounded, so buffers beyond its limits are freed instead.
+        The pool is emptied by :code:`restore`.
+
+        :note: Any references to tensors in the output dictionary must not be
+            used after calling this function.
+        """
+        for activations in self.output_ptr.values():
+            self._buffer_pool.put(activations)
+        self.output_ptr.clear()
+
     def get_module_parameter(
         self,
         parameter_name: str,
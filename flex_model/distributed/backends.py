@@ -56,6 +56,10 @@ class GPUDeviceMesh:
             parallel groups is done at the end of the forward pass when all
             pipeline parallel ranks have their retrieved activations on CPU.
 
+        :note: The mesh is computed locally and identically on every rank from
+            the parallel sizes alone, so building it requires no collective
+            communication.
+
         :param int world_size: Total number of GPUs.
         :param int tensor_parallel_size: Number of GPUs in each tensor parallel
             group.
@@ -22,6 +22,7 @@ backend is being used in the __init__method of the core `FlexModel` class.
 
 from __future__ import annotations
 
+import functools
 import logging
 from typing import Optional, Type
 
@@ -101,6 +102,23 @@ def destroy_distributed_backend() -> None:
     _ACTIVE_BACKEND = None
 
 
+@functools.lru_cache(maxsize=1)
+def _using_hf_distributed() -> bool:
+    """Check if huggingface accelerate is managing the distributed state.
+
+    :note: The accelerate distributed type is fixed by the launcher, so the
+        result is cached after the first probe.
+
+    :returns: True if accelerate is using DeepSpeed, FSDP or Megatron-LM.
+    :rtype: bool
+    """
+    return PartialState().distributed_type in {
+        accelerate.DistributedType.DEEPSPEED,
+        accelerate.DistributedType.FSDP,
+        accelerate.DistributedType.MEGATRON_LM,
+    }
+
+
 def _parse_backend() -> Type[DistributedBackend]:
     """Parse the runtime distributed state and determine the backend to use.
 
@@ -111,41 +129,16 @@ def _parse_backend() -> Type[DistributedBackend]:
 
     :returns: The corresponding `DistributedBackend` class to be instantiated.
     :rtype: Type[DistributedBackend]
-
-    :raises NotImplementedError: Unknown and unsupported distributed backend
-        found.
     """
-    global _SUPPORTED_BACKENDS
-
-    ps = PartialState()
-
-    if (
-        ps.distributed_type == accelerate.DistributedType.DEEPSPEED
-        or ps.distributed_type == accelerate.DistributedType.FSDP
-        or ps.distributed_type == accelerate.DistributedType.MEGATRON_LM
-    ):
-        hf_distributed = True
-    else:
-        hf_distributed = False
-
-    # Using huggingface accelerate with torch
-    if torch.distributed.is_initialized() and hf_distributed:
+    # Using huggingface accelerate with torch. The accelerate probe must run
+    # first, since constructing its state initializes the process group under
+    # accelerate/torchrun launches.
+    if _using_hf_distributed() and torch.distributed.is_initialized():
         return _SUPPORTED_BACKENDS["accelerate"]
 
     # Using torch distributed only. Single-gpu case is covered by torch
     # backend.
-    elif (
-        torch.distributed.is_initialized()
-        and not hf_distributed
-        or not torch.distributed.is_initialized()
-    ):
-        return _SUPPORTED_BACKENDS["torch"]
-
-    # Unsupported
-    else:
-        raise NotImplementedError(
-            "Distributed backend currently not supported."
-        )
+    return _SUPPORTED_BACKENDS["torch"]
 
 
 def _expose_distributed_backend(backend: DistributedBackend):
@@ -154,106 +147,90 @@ def _expose_distributed_backend(backend: DistributedBackend):
     _ACTIVE_BACKEND = backend
 
 
+def _backend() -> DistributedBackend:
+    """Get the active distributed backend.
+
+    :returns: The active distributed backend.
+    :rtype: DistributedBackend
+
+    :raises RuntimeError: The distributed backend has not been initialized.
+    """
+    backend = _ACTIVE_BACKEND
+    if backend is None:
+        raise RuntimeError("Distributed backend has not been initialized.")
+    return backend
+
+
 def initialize_activation_parallel() -> None:
     """Initialize activation parallel distributed groups."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    _ACTIVE_BACKEND.initialize_activation_parallel()
+    _backend().initialize_activation_parallel()
 
 
 def activation_parallel_is_initialized() -> bool:
     """Check if activation parallel distributed groups have been initialized."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.activation_parallel_is_initialized()
+    return _backend().activation_parallel_is_initialized()
 
 
 def in_tensor_parallel_group() -> bool:
     """Check if current worker belongs to a tensor parallel group."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.in_tensor_parallel_group()
+    return _backend().in_tensor_parallel_group()
 
 
 def in_pipeline_parallel_group() -> bool:
     """Check if current worker belongs to a pipeline parallel group."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.in_pipeline_parallel_group()
+    return _backend().in_pipeline_parallel_group()
 
 
 def in_data_parallel_group() -> bool:
     """Check if current worker belongs to a data parallel group."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.in_data_parallel_group()
+    return _backend().in_data_parallel_group()
 
 
 def get_activation_tensor_parallel_group() -> Optional[pt_dist.ProcessGroup]:
     """Get the activation parallel tp group."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.get_activation_tensor_parallel_group()
+    return _backend().get_activation_tensor_parallel_group()
 
 
 def get_activation_data_parallel_group() -> Optional[pt_dist.ProcessGroup]:
     """Get the activation parallel dp group."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.get_activation_data_parallel_group()
+    return _backend().get_activation_data_parallel_group()
 
 
 def get_activation_pipeline_parallel_group() -> Optional[pt_dist.ProcessGroup]:
     """Get the activation parallel dp group."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.get_activation_pipeline_parallel_group()
+    return _backend().get_activation_pipeline_parallel_group()
 
 
 def get_activation_tensor_parallel_world_size() -> int:
     """Get the activation parallel tp group world size."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.get_activation_tensor_parallel_world_size()
+    return _backend().get_activation_tensor_parallel_world_size()
 
 
 def get_activation_data_parallel_world_size() -> int:
     """Get the activation parallel dp group world size."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.get_activation_data_parallel_world_size()
+    return _backend().get_activation_data_parallel_world_size()
 
 
 def get_activation_pipeline_parallel_world_size() -> int:
     """Get the activation parallel dp group world size."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.get_activation_pipeline_parallel_world_size()
+    return _backend().get_activation_pipeline_parallel_world_size()
 
 
 def get_activation_tensor_parallel_rank() -> int:
     """Get the activation parallel tp group world size."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.get_activation_tensor_parallel_rank()
+    return _backend().get_activation_tensor_parallel_rank()
 
 
 def get_activation_data_parallel_rank() -> int:
     """Get the data parallel dp group world size."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.get_activation_data_parallel_rank()
+    return _backend().get_activation_data_parallel_rank()
 
 
 def get_activation_pipeline_parallel_rank() -> int:
     """Get the data parallel dp group world size."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    return _ACTIVE_BACKEND.get_activation_pipeline_parallel_rank()
+    return _backend().get_activation_pipeline_parallel_rank()
 
 
 def destroy_activation_parallel() -> None:
     """Destroy the activation parallel groups."""
-    global _ACTIVE_BACKEND
-    assert _ACTIVE_BACKEND is not None
-    _ACTIVE_BACKEND.destroy_activation_parallel()
+    _backend().destroy_activation_parallel()
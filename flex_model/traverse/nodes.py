@@ -1,6 +1,18 @@
 from __future__ import annotations
 
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import functools
+import inspect
+import operator
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from torch import Tensor
 from transformers.modeling_outputs import BaseModelOutputWithPast
@@ -16,11 +28,27 @@ ScalarNode = Any
 _INTERNAL_NODE_TYPE_REGISTRY: Dict[type, InternalNode] = {}
 _LEAF_NODE_TYPE_REGISTRY: Dict[type, LeafNode] = {}
 
+# Small integer tags classifying objects/nodes during traversal.
+LEAF_KIND = 0
+INTERNAL_KIND = 1
+SCALAR_KIND = 2
+
+# Unified view of both registries, so classifying an object during traversal
+# costs a single lookup. Types hash by identity already, so keying this by
+# `id(type)` would only add a call per lookup.
+_NODE_TYPE_REGISTRY: Dict[type, Tuple[int, type]] = {}
+_SCALAR_ENTRY: Tuple[int, None] = (SCALAR_KIND, None)
+
 
 def register_internal_node_type(internal_node_type: type) -> Callable:
     """Decorator for registering :class:`InternalNode` classes with a
     corresponding :code:`type`.
 
+    :note: Node classes implementing :code:`flatten` as an instance method
+        (ie. :code:`def flatten(self, instance)`) are still supported. Their
+        :code:`flatten` is wrapped into a static method which calls it on a
+        new node instance.
+
     :param type internal_node_type: The :code:`type` associated with the node.
 
     :returns: Inner function which registers the :class:`InternalNode` child
@@ -28,7 +56,21 @@ def register_internal_node_type(internal_node_type: type) -> Callable:
     """
 
     def _inner(_internal_node_cls: InternalNode) -> InternalNode:
+        # Traversals call `flatten` on the node class.
+        flatten_fn = inspect.getattr_static(_internal_node_cls, "flatten")
+        if not isinstance(flatten_fn, (staticmethod, classmethod)):
+
+            @functools.wraps(flatten_fn)
+            def _flatten(instance: InternalObject) -> Tuple[Any, ...]:
+                return flatten_fn(_internal_node_cls(), instance)
+
+            _internal_node_cls.flatten = staticmethod(_flatten)
+
         _INTERNAL_NODE_TYPE_REGISTRY[internal_node_type] = _internal_node_cls
+        _NODE_TYPE_REGISTRY[internal_node_type] = (
+            INTERNAL_KIND,
+            _internal_node_cls,
+        )
         return _internal_node_cls
 
     return _inner
@@ -46,6 +88,7 @@ def register_leaf_node_type(leaf_node_type: type) -> Callable:
 
     def _inner(_leaf_node_cls: LeafNode) -> LeafNode:
         _LEAF_NODE_TYPE_REGISTRY[leaf_node_type] = _leaf_node_cls
+        _NODE_TYPE_REGISTRY[leaf_node_type] = (LEAF_KIND, _leaf_node_cls)
         return _leaf_node_cls
 
     return _inner
@@ -55,20 +98,26 @@ class InternalNode:
     """Node correponding to unpackable container. These are nodes which we can
     always unpack other python objects from to continue traversal.
 
-    :var children: A list of children nodes.
-    :type children: Optional[List[Union[InternalNode, LeafNode, ScalarNode]]]
+    :var children: A list of children nodes. Tree definitions produced by
+        :code:`flatten` hold their children in a tuple.
+    :type children: Optional[Sequence[Union[InternalNode, LeafNode, ScalarNode]]]
     """
 
+    __slots__ = ("children",)
+
+    # Node kind tag, read in place of repeated isinstance checks.
+    _kind = INTERNAL_KIND
+
     def __init__(
         self,
         children: Optional[
-            List[Union[InternalNode, LeafNode, ScalarNode]]
+            Sequence[Union[InternalNode, LeafNode, ScalarNode]]
         ] = None,
     ) -> None:
         self.children = children if children is not None else []
 
     def __eq__(self, other: Any) -> bool:
-        """Traverse subtree checking for node equality recursively.
+        """Traverse subtree checking for node equality.
 
         :param Any other: Other node defining a subtree to check equality
             against.
@@ -77,34 +126,36 @@ class InternalNode:
         :rtype: bool
         """
 
-        def _dfs(
-            node1: Union[InternalNode, LeafNode, ScalarNode],
-            node2: Union[InternalNode, LeafNode, ScalarNode],
-        ) -> bool:
+        # Iterative traversal, since deeply nested objects can exceed the
+        # recursion limit.
+        stack = [(self, other)]
+        stack_pop = stack.pop
+        stack_extend = stack.extend
+        while stack:
+            node1, node2 = stack_pop()
+
             # Mismatched types
-            if type(node1) != type(node2):
+            if type(node1) is not type(node2):
                 return False
 
+            # Types match, so the kind of `node1` is also the kind of `node2`.
+            kind = getattr(node1, "_kind", SCALAR_KIND)
+
             # Leaf node case
-            if is_leaf_node(node1) and is_leaf_node(node2):
-                return True
+            if kind == LEAF_KIND:
+                continue
 
             # Internal node case
-            elif is_internal_node(node1) and is_internal_node(node2):
+            elif kind == INTERNAL_KIND:
                 if len(node1.children) != len(node2.children):
                     return False
-
-                subtrees_equal = []
-                for n1, n2 in zip(node1.children, node2.children):
-                    subtree = _dfs(n1, n2)
-                    subtrees_equal.append(subtree)
-                return all(subtrees_equal)
+                stack_extend(zip(node1.children, node2.children))
 
             # Scalar node case
-            else:
-                return node1 == node2
+            elif not node1 == node2:
+                return False
 
-        return _dfs(self, other)
+        return True
 
     def __repr__(self) -> str:
         return f"Node({self.children})"
@@ -112,24 +163,41 @@ class InternalNode:
     def __str__(self) -> str:
         return self.__repr__()
 
-    def flatten(self, instance):
+    @staticmethod
+    def flatten(instance):
         """Flatten the associated instance by returning its contents.
         :note: Child classes must implement this.
 
         :note: All flattening functions return a tuple of the unpacked elements.
+
+        :note: Flattening only depends on the instance, so it is a static
+            method and can be called on the node class directly. Child
+            classes should implement it as a static method too. Instance
+            method implementations are wrapped on registration, at the cost
+            of creating a node per flattened instance.
         """
         raise NotImplementedError
 
     def unflatten(self, children):
         """Pack the contents (children) back into the associated container.
         :note: Child classes must implement this.
+
+        :note: Child classes may bind builtin callables (ie.
+            :code:`staticmethod(tuple)`) as :code:`flatten`/:code:`unflatten`,
+            which skips a python frame per node during traversal.
         """
         raise NotImplementedError
 
 
 @register_internal_node_type(tuple)
 class TupleNode(InternalNode):
-    """Unpackable node corresponding to tuples."""
+    """Unpackable node corresponding to tuples. Flattening returns the tuple
+    itself, and unflattening builds a tuple from the children.
+    """
+
+    __slots__ = ()
+
+    unflatten = staticmethod(tuple)
 
     def __repr__(self) -> str:
         return f"TupleNode({self.children})"
@@ -137,7 +205,8 @@ class TupleNode(InternalNode):
     def __str__(self) -> str:
         return self.__repr__()
 
-    def flatten(self, instance: Tuple[Any, ...]) -> Tuple[Any, ...]:
+    @staticmethod
+    def flatten(instance: Tuple[Any, ...]) -> Tuple[Any, ...]:
         """Unpack the tuple. Flattening functions always return a tuple of the
         unpacked elements, so this function does nothing.
 
@@ -148,20 +217,17 @@ class TupleNode(InternalNode):
         """
         return instance
 
-    def unflatten(self, children: List[Any]) -> Tuple[Any, ...]:
-        """Re-assemble the tuple.
-
-        :param List[Any] children: List of elements to repack the tuple with.
-
-        :returns: A tuple of the repacked elements.
-        :rtype: Tuple[Any, ...]
-        """
-        return tuple(child for child in children)
-
 
 @register_internal_node_type(list)
 class ListNode(InternalNode):
-    """Unpackable node corresponding to lists."""
+    """Unpackable node corresponding to lists. Flattening returns the
+    elements in a tuple, and unflattening builds a list from the children.
+    """
+
+    __slots__ = ()
+
+    flatten = staticmethod(tuple)
+    unflatten = staticmethod(list)
 
     def __repr__(self) -> str:
         return f"ListNode({self.children})"
@@ -169,52 +235,29 @@ class ListNode(InternalNode):
     def __str__(self) -> str:
         return self.__repr__()
 
-    def flatten(self, instance: List[Any]) -> Tuple[Any, ...]:
-        """Unpack the list.
-
-        :param List[Any] instance: List instance to unpack.
-
-        :returns: A tuple of the unpacked elements.
-        :rtype: Tuple[Any, ...]
-        """
-        return tuple(instance)
-
-    def unflatten(self, children: List[Any]) -> List[Any]:
-        """Re-assemble the list.
-
-        :param List[Any] children: List of elemnets to repack the list with.
-
-        :returns: A list of the repacked elements.
-        :rtype: List[Any]
-        """
-        return list(child for child in children)
-
 
 @register_internal_node_type(BaseModelOutputWithPast)
 class BaseModelOutputWithPastNode(InternalNode):
-    """Node corresponding to Huggingface BaseModelOutputWithPast object."""
-
-    def __repr__(self) -> str:
-        return f"BaseModelOutputWithPastNode({self.children})"
-
-    def flatten(
-        self, instance: BaseModelOutputWithPast
-    ) -> Tuple[Any, Any, Any, Any]:
-        """Unpack the :code:`BaseModelOutputWithPast`.
+    """Node corresponding to Huggingface BaseModelOutputWithPast object.
+    Flattening returns a 4-tuple containing the hidden state and other cached
+    values.
+    """
 
-        :param BaseModelOutputWithPast instance: :code:`BaseModelOutputWithPast` to
-            unpack.
+    __slots__ = ()
 
-        :returns: A 4-tuple containing hidden state and other cached values.
-        :rtype: Tuple[Any, Any, Any, Any, Any]
-        """
-        contents = (
-            instance.last_hidden_state,
-            instance.past_key_values,
-            instance.hidden_states,
-            instance.attentions,
+    # Fetches all of the fields in one call, in the order expected by the
+    # constructor. Dataclass-like nodes should unpack themselves this way.
+    flatten = staticmethod(
+        operator.attrgetter(
+            "last_hidden_state",
+            "past_key_values",
+            "hidden_states",
+            "attentions",
         )
-        return contents
+    )
+
+    def __repr__(self) -> str:
+        return f"BaseModelOutputWithPastNode({self.children})"
 
     def unflatten(self, children: List[Any]) -> BaseModelOutputWithPast:
         """Re-assemble the :code:`BaseModelOutputWithPast`.
@@ -235,6 +278,11 @@ class LeafNode:
         metadata.
     """
 
+    __slots__ = ("val",)
+
+    # Node kind tag, read in place of repeated isinstance checks.
+    _kind = LEAF_KIND
+
     def __init__(self, val: Any = None) -> None:
         self.val = val
 
@@ -252,6 +300,8 @@ class LeafNode:
 class TensorNode(LeafNode):
     """Leaf node corresponding to a Pytorch tensor."""
 
+    __slots__ = ()
+
     def __eq__(self, other: Any) -> bool:
         if not isinstance(other, TensorNode):
             return False
@@ -262,6 +312,9 @@ class TensorNode(LeafNode):
         return f"TensorNode<{self.val}>"
 
 
+# NOTE: The lookup helpers below are a plain dict lookup each, which is
+#       cheaper than going through an `lru_cache` wrapper. The traversal hot
+#       paths use `classify_obj` instead, which answers all of them at once.
 def get_internal_node(internal_obj: InternalObject) -> InternalNode:
     """Retrieve the corresponding :class:`InternalNode` representation of an
     :class:`InternalObject`.
@@ -288,18 +341,32 @@ def get_leaf_node(leaf_obj: LeafObject) -> LeafNode:
 
 # TODO: Deprecate in favour of _flatten
 def _recursively_find_first_tensor(
-    obj: Union[InternalObject, LeafObject, ScalarObject]
+    obj: Union[InternalObject, LeafObject, ScalarObject],
 ) -> Optional[Tensor]:
-    if is_leaf_obj(obj):
-        return obj
-
-    if not is_internal_obj(obj):
-        return
-
-    for ele in obj:
-        res = _recursively_find_first_tensor(ele)
-        if res is not None:
-            return res
+    # Iterative depth-first search returning on the first leaf found. Children
+    # are pushed in reverse so the left-most leaf is found first.
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        kind, node_cls = classify_obj(obj)
+        if kind == LEAF_KIND:
+            return obj
+        if kind == INTERNAL_KIND:
+            stack.extend(reversed(node_cls.flatten(obj)))
+    return None
+
+
+def classify_obj(obj: Any) -> Tuple[int, Optional[type]]:
+    """Classify an object as a leaf, internal or scalar object.
+
+    :param Any obj: Object to classify.
+
+    :returns: The kind of the object (one of :code:`LEAF_KIND`,
+        :code:`INTERNAL_KIND` or :code:`SCALAR_KIND`), and the corresponding
+        node class. Scalar objects have no node class.
+    :rtype: Tuple[int, Optional[type]]
+    """
+    return _NODE_TYPE_REGISTRY.get(type(obj), _SCALAR_ENTRY)
 
 
 def is_leaf_obj(obj: Any) -> bool:
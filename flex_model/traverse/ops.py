@@ -1,22 +1,167 @@
 from __future__ import annotations
 
-from typing import Any, List, Optional, Tuple, Union
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from torch import Tensor
 
 from .nodes import (
+    _NODE_TYPE_REGISTRY,
+    _SCALAR_ENTRY,
+    INTERNAL_KIND,
+    LEAF_KIND,
     InternalNode,
     LeafNode,
     ScalarNode,
-    get_internal_node,
-    get_leaf_node,
+    TensorNode,
+    TupleNode,
     is_internal_node,
-    is_internal_obj,
     is_leaf_node,
-    is_leaf_obj,
 )
 
 
+# NOTE: The traversal is kept in pure python so the package stays free of
+#       compiled extensions. Layer outputs are small, shallow containers, so
+#       the per-node work is dominated by the fast paths in
+#       `HookFunction._unpack_layer_outputs` and the tree definition cache
+#       below rather than by interpreter overhead in the traversal itself.
+
+# Tree definitions of recently flattened objects, keyed by their structure.
+# Hooks flatten structurally identical layer outputs on every forward pass, so
+# cache hits skip building the tree definition entirely.
+_TREEDEF_CACHE: Dict[Tuple[Any, ...], Any] = {}
+_TREEDEF_CACHE_SIZE = 128
+_MISSING = object()
+
+# Hook functions can run concurrently in threads (ie. under
+# `nn.DataParallel`), so cache eviction and insertion are serialized. Lookups
+# are single dict operations and don't need the lock.
+_TREEDEF_CACHE_LOCK = threading.Lock()
+
+# Scalars are embedded verbatim in tree definitions, so a cached tree
+# definition is only valid if its scalars compare equal exactly when they are
+# interchangeable. This also keeps the cache from holding references to
+# arbitrary (potentially large) objects.
+_CACHEABLE_SCALAR_TYPES = frozenset({type(None), bool, int, str, bytes})
+
+
+def _build_nodes(
+    parents: List[List[Any]],
+    skeleton: List[Tuple[int, type, Any]],
+) -> None:
+    """Build tree definition nodes from a pre-order record of visited objects,
+    placing them into the open parents.
+
+    :param parents: Stack of open parents, each a :code:`[node class,
+        children list, number of children left]` entry. Internal nodes are
+        only created once all of their children are built, so they receive
+        their final (immutable) children tuple directly. The bottom entry has
+        no node class and collects the root node.
+    :type parents: List[List[Any]]
+    :param skeleton: Pre-order list of :code:`(kind, cls, val)` entries
+        produced by :code:`flatten`. For leaf and internal objects
+        :code:`cls` is the node class and :code:`val` is the leaf shape or the
+        number of children respectively. For scalars :code:`cls` is the
+        scalar's type and :code:`val` is the scalar itself.
+    :type skeleton: List[Tuple[int, type, Any]]
+    """
+    parents_append = parents.append
+    parents_pop = parents.pop
+    for kind, node_cls, val in skeleton:
+        if kind == LEAF_KIND:
+            node = node_cls(val=val)
+        elif kind == INTERNAL_KIND:
+            if val > 0:
+                parents_append([node_cls, [], val])
+                continue
+            node = node_cls(children=())
+        else:
+            node = val
+
+        # Place the node, then build every parent which it completes.
+        while True:
+            parent = parents[-1]
+            parent[1].append(node)
+            parent[2] -= 1
+            if parent[2] > 0 or parent[0] is None:
+                break
+            parents_pop()
+            node = parent[0](children=tuple(parent[1]))
+
+
+def _build_treedef(
+    skeleton: List[Tuple[int, type, Any]],
+) -> Union[InternalNode, LeafNode, ScalarNode]:
+    """Build a tree definition from a pre-order record of visited objects.
+
+    :param skeleton: Pre-order list of :code:`(kind, cls, val)` entries
+        produced by :code:`flatten`.
+    :type skeleton: List[Tuple[int, type, Any]]
+
+    :returns: The root node of the tree definition.
+    :rtype: Union[InternalNode, LeafNode, ScalarNode]
+    """
+    root_holder = []
+    _build_nodes([[None, root_holder, 1]], skeleton)
+    return root_holder[0]
+
+
+def _get_cached_treedef(
+    skeleton: List[Tuple[int, type, Any]],
+) -> Union[InternalNode, LeafNode, ScalarNode]:
+    """Retrieve the tree definition for a skeleton from the cache, building
+    and caching it on a miss.
+
+    :param skeleton: Pre-order list of :code:`(kind, cls, val)` entries
+        produced by :code:`flatten`, containing only cacheable scalars.
+    :type skeleton: List[Tuple[int, type, Any]]
+
+    :returns: The root node of the tree definition.
+    :rtype: Union[InternalNode, LeafNode, ScalarNode]
+    """
+    key = tuple(skeleton)
+    treedef = _TREEDEF_CACHE.get(key, _MISSING)
+    if treedef is _MISSING:
+        treedef = _build_treedef(skeleton)
+
+        with _TREEDEF_CACHE_LOCK:
+            # FIFO eviction.
+            if len(_TREEDEF_CACHE) >= _TREEDEF_CACHE_SIZE:
+                del _TREEDEF_CACHE[next(iter(_TREEDEF_CACHE))]
+            _TREEDEF_CACHE[key] = treedef
+
+    return treedef
+
+
+def _flatten_tuple_of_tensors(
+    root_obj: Tuple[Any, ...],
+) -> Tuple[List[Tuple[int, type, Any]], List[Tensor]]:
+    """Flatten a tuple whose elements are all tensors or tuples of tensors,
+    like Huggingface :code:`past_key_values`, without going through the
+    generic traversal.
+
+    :note: The caller must check that the tuple has this structure.
+
+    :param Tuple[Any, ...] root_obj: The tuple to flatten.
+
+    :returns: The skeleton and leaves of the tuple, in the same form as
+        :code:`flatten` would produce them.
+    :rtype: Tuple[List[Tuple[int, type, Any]], List[Tensor]]
+    """
+    skeleton = [(INTERNAL_KIND, TupleNode, len(root_obj))]
+    leaves = []
+    for child in root_obj:
+        if type(child) is Tensor:
+            leaves.append(child)
+            skeleton.append((LEAF_KIND, TensorNode, child.shape))
+        else:
+            leaves.extend(child)
+            skeleton.append((INTERNAL_KIND, TupleNode, len(child)))
+            skeleton.extend([(LEAF_KIND, TensorNode, t.shape) for t in child])
+
+    return skeleton, leaves
+
+
 def flatten(
     root_obj: Any,
 ) -> Tuple[Union[InternalNode, LeafNode, ScalarNode], List[Optional[Tensor]]]:
@@ -29,50 +174,202 @@ def flatten(
     :note: The traversal is done in a depth-first way to bias us towards
         finding the left-most leaf node first.
 
+    :note: Only objects of registered leaf types (ie. tensors) are returned
+        as leaves, and only registered internal types are traversed. All
+        other objects, including :code:`None` and unregistered containers like
+        dicts, are kept verbatim as scalar nodes in the tree definition.
+
+    :note: Tree definitions are cached by structure, so flattening
+        structurally identical objects may return the same tree definition
+        instance. Tree definitions must not be modified.
+
     :param Any root_obj: The python object to flatten.
 
     :returns: A tree definition of the python object and a list of leaf
         objects (typically Pytorch tensors).
     :rtype: Tuple[Union[InternalNode, LeafNode, ScalarNode], List[Optional[Tensor]]]
     """
-    order = []
+    # NOTE: The registry is read directly instead of through `classify_obj`,
+    #       since a function call per object is a large part of the cost of
+    #       flattening small layer outputs.
+    registry_get = _NODE_TYPE_REGISTRY.get
+
+    # Bare leaves and scalars don't need a traversal, nor the cache.
+    kind, node_cls = registry_get(type(root_obj), _SCALAR_ENTRY)
+    if kind == LEAF_KIND:
+        return node_cls(val=root_obj.shape), [root_obj]
+    if kind != INTERNAL_KIND:
+        return root_obj, []
+
+    # Scan the root's children once up front to pick a strategy:
+    #   1. Tuples of tensors or tuples of tensors (ie. `past_key_values`) are
+    #      the most common layer outputs, so they skip the generic traversal.
+    #   2. Layer outputs often hold uncacheable objects (ie. Huggingface
+    #      caches) directly. Their tree definitions are never looked up in the
+    #      cache, so nodes are built directly from the start.
+    #   3. Roots without internal children are cheaper to build in a single
+    #      pass over their children than to look up in the cache.
+    # NOTE: Explicit loops are used over `all(...)`, since creating the
+    #       generator costs more than checking these small containers.
+    root_children = node_cls.flatten(root_obj)
+    tensors_only = type(root_obj) is tuple
+    uncacheable = False
+    shallow = True
+    for child in root_children:
+        child_type = type(child)
+        if child_type is Tensor:
+            continue
+        if child_type is tuple:
+            shallow = False
+            if tensors_only:
+                for t in child:
+                    if type(t) is not Tensor:
+                        tensors_only = False
+                        break
+            continue
+        tensors_only = False
+        if child_type in _NODE_TYPE_REGISTRY:
+            if _NODE_TYPE_REGISTRY[child_type][0] == INTERNAL_KIND:
+                shallow = False
+        elif child_type not in _CACHEABLE_SCALAR_TYPES:
+            uncacheable = True
+
+    if tensors_only:
+        skeleton, leaves = _flatten_tuple_of_tensors(root_obj)
+        return _get_cached_treedef(skeleton), leaves
+
+    # Bind hot-path lookups to locals, since they are hit once per object.
     leaves = []
+    leaves_append = leaves.append
+
+    if shallow:
+        children = []
+        for child in root_children:
+            kind, child_cls = registry_get(type(child), _SCALAR_ENTRY)
+            if kind == LEAF_KIND:
+                leaves_append(child)
+                child = child_cls(val=child.shape)
+            children.append(child)
+        return node_cls(children=tuple(children)), leaves
+
+    # Pre-order record of visited objects. It doubles as the cache key, and
+    # is used to build the tree definition on a cache miss. Once an
+    # uncacheable scalar is found the skeleton is dropped, and nodes are
+    # built directly into the open parents instead (see `_build_nodes`).
+    root_holder = []
+    if uncacheable:
+        skeleton = None
+        parents = [[None, root_holder, 1]]
+        parents_pop = parents.pop
+    else:
+        skeleton = []
+        skeleton_append = skeleton.append
+        parents = None
+
+    # Iterative depth-first traversal, since deeply nested objects can exceed
+    # the recursion limit. Children are pushed in reverse so they are visited
+    # from left to right.
+    stack = [root_obj]
+    stack_pop = stack.pop
+    stack_extend = stack.extend
+    while stack:
+        obj = stack_pop()
+        kind, node_cls = registry_get(type(obj), _SCALAR_ENTRY)
 
-    def _dfs(obj):
         # Leaf obj case
-        if is_leaf_obj(obj):
-            leaf_node = get_leaf_node(obj)(val=obj.shape)
-            order.append(leaf_node)
-            leaves.append(obj)
-            return leaf_node
-
-        # Internal obj recursive case
-        elif is_internal_obj(obj):
+        if kind == LEAF_KIND:
+            leaves_append(obj)
+            if skeleton is not None:
+                skeleton_append((kind, node_cls, obj.shape))
+                continue
+            node = node_cls(val=obj.shape)
+
+        # Internal obj case
+        elif kind == INTERNAL_KIND:
             # NOTE: Each node needs to know how to flatten its associated type
             #       instance. Ie. BaseModelOutputWithPast needs to be able to
             #       return its attributes in a tuple. They should also be able
             #       to perfectly recreate instances of themselves using a list of
             #       children.
-            internal_node = get_internal_node(obj)()
-            order.append(internal_node)
+            unvisited_children = node_cls.flatten(obj)
+            num_children = len(unvisited_children)
 
-            # Internal node knows how to unpack its equivalent internal object
-            unvisited_children = internal_node.flatten(obj)
+            # Children which are all leaves of the same type (ie. a tuple of
+            # tensors) are collected in bulk, since they would be popped and
+            # appended one by one in this same order anyways.
+            leaf_children = False
+            if num_children:
+                child_type = type(unvisited_children[0])
+                child_kind, child_cls = registry_get(child_type, _SCALAR_ENTRY)
+                if child_kind == LEAF_KIND:
+                    for child in unvisited_children:
+                        if type(child) is not child_type:
+                            break
+                    else:
+                        leaf_children = True
+                        leaves.extend(unvisited_children)
 
-            # Recurse into internal object's children
-            for child in unvisited_children:
-                internal_node.children.append(_dfs(child))
-            return internal_node
+            if skeleton is not None:
+                skeleton_append((kind, node_cls, num_children))
+                if leaf_children:
+                    skeleton.extend(
+                        [
+                            (child_kind, child_cls, child.shape)
+                            for child in unvisited_children
+                        ]
+                    )
+                else:
+                    stack_extend(reversed(unvisited_children))
+                continue
+
+            if leaf_children:
+                node = node_cls(
+                    children=tuple(
+                        [
+                            child_cls(val=child.shape)
+                            for child in unvisited_children
+                        ]
+                    )
+                )
+            elif num_children:
+                # Visit internal object's children next
+                parents.append([node_cls, [], num_children])
+                stack_extend(reversed(unvisited_children))
+                continue
+            else:
+                node = node_cls(children=())
 
         # Scalar obj case
         else:
-            # Scalar nodes are just objects
-            scalar_node = obj
-            order.append(scalar_node)
-            return scalar_node
+            # Scalar nodes are just objects. Their type is kept so that equal
+            # scalars of different types (ie. 1 and True) do not share keys.
+            if skeleton is not None:
+                obj_type = type(obj)
+                if obj_type in _CACHEABLE_SCALAR_TYPES:
+                    skeleton_append((kind, obj_type, obj))
+                    continue
+
+                # Switch to building nodes directly.
+                parents = [[None, root_holder, 1]]
+                parents_pop = parents.pop
+                _build_nodes(parents, skeleton)
+                skeleton = None
+            node = obj
+
+        # Place the node, then build every parent which it completes.
+        while True:
+            parent = parents[-1]
+            parent[1].append(node)
+            parent[2] -= 1
+            if parent[2] > 0 or parent[0] is None:
+                break
+            parents_pop()
+            node = parent[0](children=tuple(parent[1]))
 
-    _dfs(root_obj)
-    return order[0], leaves
+    if skeleton is None:
+        return root_holder[0], leaves
+
+    return _get_cached_treedef(skeleton), leaves
 
 
 def unflatten(
@@ -91,21 +388,50 @@ def unflatten(
     :returns: The reconstructed python objects.
     :rtype: Any
     """
-    leaves = list(reversed(leaves))
+    # Leaves are visited in the same left-to-right order they were collected
+    # in by `flatten`.
+    leaves_it = iter(leaves)
 
-    def _dfs(node):
-        # Leaf node case
-        if is_leaf_node(node):
-            return leaves.pop()
+    # Leaf node case
+    if is_leaf_node(root_node):
+        return next(leaves_it)
 
-        # Internal node case
-        elif is_internal_node(node):
-            # Node knows how to pack itself up again into its corresponding obj
-            obj = node.unflatten(_dfs(child) for child in node.children)
-            return obj
+    # Scalar node case
+    if not is_internal_node(root_node):
+        return root_node
 
-        # Scalar node case
-        else:
-            return node
+    # Iterative depth-first traversal. Each stack frame holds an internal
+    # node, an iterator over its remaining children and the objects already
+    # rebuilt from its visited children.
+    # Bind hot-path lookups to locals, since they are hit once per node.
+    _is_leaf_node = is_leaf_node
+    _is_internal_node = is_internal_node
+    next_leaf = leaves_it.__next__
+
+    stack = [(root_node, iter(root_node.children), [])]
+    stack_append = stack.append
+    stack_pop = stack.pop
+    while True:
+        node, unvisited_children, children_objs = stack[-1]
+        for child in unvisited_children:
+            # Leaf node case
+            if _is_leaf_node(child):
+                children_objs.append(next_leaf())
 
-    return _dfs(root_node)
+            # Internal node case, finish the child's subtree first.
+            elif _is_internal_node(child):
+                stack_append((child, iter(child.children), []))
+                break
+
+            # Scalar node case
+            else:
+                children_objs.append(child)
+
+        # All children visited, so the node knows how to pack itself up again
+        # into its corresponding obj.
+        else:
+            stack_pop()
+            obj = node.unflatten(children_objs)
+            if not stack:
+                return obj
+            stack[-1][2].append(obj)
@@ -7,6 +7,7 @@ import torch
 import torch.nn as nn
 
 from flex_model.core import FlexModel, HookFunction
+from flex_model.core.hook_function import _BufferPool
 
 # could be any MLP layer and the code won't break. The test doesn't generalize
 # to other kinds of layers
@@ -115,3 +116,93 @@ def test_hook_function(make_opt_350m, opt_tokenizer, offload_mode):
     else:
         assert torch.allclose(ground_truth.cuda(), activations[MODULE_NAME][0])
         assert activations[MODULE_NAME][0].device.type == "cuda"
+
+
+def test_pre_hook_functions():
+    """
+    Tests if HookFunction implements forward and backward pre-hooks correctly
+    """
+    model = nn.Sequential(nn.Linear(4, 4), nn.Linear(4, 4))
+    inputs = torch.randn((2, 4), requires_grad=True)
+
+    activations = {}
+    model = FlexModel(model, activations)
+    model.register_forward_pre_hook(HookFunction("1", (None, None)))
+    model.register_full_backward_pre_hook(HookFunction("0", (None, None)))
+
+    outputs = model(inputs)
+    assert torch.equal(activations["1"][0], model.module[0](inputs).detach())
+
+    outputs.sum().backward()
+    assert torch.equal(
+        activations["0"][0], model.module[1].weight.sum(dim=0).expand(2, 4)
+    )
+
+
+def test_compile_editing_function(monkeypatch, caplog):
+    """
+    Tests if compiled editing functions fall back to eager mode when
+    compilation fails
+    """
+
+    def _failing_backend(gm, example_inputs):
+        raise RuntimeError("Compilation failed")
+
+    def _failing_compile(fn, *args, **kwargs):
+        raise RuntimeError("Compilation not supported")
+
+    model = nn.Sequential(nn.Linear(4, 4), nn.Linear(4, 4))
+    inputs = torch.randn((2, 4))
+    gt_out = model[1](model[0](inputs) * 2)
+
+    compile_fn = torch.compile
+    for patched_compile_fn, should_fall_back in [
+        (partial(compile_fn, backend="eager"), False),
+        (partial(compile_fn, backend=_failing_backend), True),
+        (_failing_compile, True),
+    ]:
+        monkeypatch.setattr(torch, "compile", patched_compile_fn)
+        activations = {}
+        flex_model = FlexModel(model, activations)
+        flex_model.register_forward_hook(
+            HookFunction(
+                "0",
+                (None, None),
+                editing_function=lambda m, x, save_ctx, modules: x * 2,
+                compile_editing_function=True,
+            )
+        )
+
+        # Run twice, so the fallback is also used after the first call.
+        caplog.clear()
+        for _ in range(2):
+            assert torch.allclose(flex_model(inputs), gt_out)
+        flex_model.restore()
+
+        fallback_warnings = [
+            r for r in caplog.records if "falling back to eager" in r.message
+        ]
+        assert len(fallback_warnings) == should_fall_back
+
+
+def test_buffer_pool_limits():
+    """
+    Tests if the buffer pool drops buffers beyond its limits, and if pooled
+    buffers are reused.
+    """
+    pool = _BufferPool(max_buffers_per_key=2, max_buffers=3)
+    small = [torch.empty((2, 4), device="cuda") for _ in range(3)]
+    large = [torch.empty((4, 4), device="cuda") for _ in range(2)]
+
+    # Third small buffer exceeds the per-key limit, second large buffer
+    # exceeds the total limit.
+    pool.put(small + large)
+    assert len(pool) == 3
+
+    assert pool.get_like(small[0]) is small[1]
+    assert pool.get_like(large[0]) is large[0]
+    assert len(pool) == 1
+
+    pool.clear()
+    assert len(pool) == 0
+    assert pool.get_like(small[0]) is not small[0]
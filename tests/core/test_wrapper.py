@@ -1,5 +1,6 @@
 from functools import partial
 
+import pytest
 import torch
 import torch.nn as nn
 
@@ -246,3 +247,114 @@ def test_FlexModel_group_creation(make_opt_350m, opt_tokenizer):
         if "self_attn" in hook_fn.module_name:
             assert "new_group" in groups
         assert "all" in groups
+
+
+@pytest.mark.parametrize("offload_mode", ["CPU", "GPU"])
+def test_release_activations(make_opt_350m, opt_tokenizer, offload_mode):
+    model = make_opt_350m().cuda()
+    prompts = [
+        opt_tokenizer(p, padding=True, return_tensors="pt")["input_ids"].cuda()
+        for p in [PROMPTS, PROMPTS[::-1]]
+    ]
+
+    # Reference activations, copied synchronously by a plain Pytorch hook.
+    ground_truth = []
+    model.get_submodule(MODULE_NAME_1).register_forward_hook(
+        lambda m, i, o: ground_truth.append(o.detach().cpu())
+    )
+
+    activations = {}
+    model = FlexModel(model, activations, offload_mode=offload_mode)
+
+    my_hook_function = HookFunction(
+        MODULE_NAME_1,
+        expected_shape=(None, None, None),
+    )
+    model.register_forward_hook(my_hook_function)
+
+    # Activations are readable as soon as the forward pass returns.
+    _ = model(prompts[0])
+    assert len(model._shared_state.pending_offload_devices) == 0
+    first_act = activations[MODULE_NAME_1][0]
+    if offload_mode == "CPU":
+        assert first_act.is_pinned()
+    else:
+        assert first_act.is_cuda
+    assert torch.equal(first_act.cpu(), ground_truth[0])
+
+    # Released buffers are reused by the next forward pass.
+    model.release_activations()
+    assert len(activations) == 0
+
+    _ = model(prompts[1])
+    assert activations[MODULE_NAME_1][0] is first_act
+    assert torch.equal(activations[MODULE_NAME_1][0].cpu(), ground_truth[1])
+
+
+@pytest.mark.parametrize("offload_mode", ["CPU", "GPU"])
+def test_release_activations_shared_module(offload_mode):
+    """
+    Tests if buffers released by forward and backward hooks on the same module
+    are reused by both, instead of accumulating in the pool.
+    """
+    model = nn.Sequential(nn.Linear(4, 4), nn.Linear(4, 4)).cuda()
+    inputs = torch.randn((2, 4), device="cuda")
+
+    activations = {}
+    model = FlexModel(model, activations, offload_mode=offload_mode)
+    model.register_forward_hook(HookFunction("1", expected_shape=(None, None)))
+    model.register_full_backward_hook(
+        HookFunction("1", expected_shape=(None, None))
+    )
+
+    buffer_ids = None
+    for _ in range(3):
+        model(inputs).sum().backward()
+        assert len(activations["1"]) == 2
+
+        # Both hooks draw from the same pooled buffers on every pass.
+        ids = {id(a) for a in activations["1"]}
+        assert buffer_ids is None or ids == buffer_ids
+        buffer_ids = ids
+
+        model.release_activations()
+        assert len(model._buffer_pool) == 2
+
+    # Pooled buffers are freed once the hooks are removed.
+    model.restore()
+    assert len(model._buffer_pool) == 0
+
+
+def test_async_offload(make_opt_350m, opt_tokenizer):
+    model = make_opt_350m().cuda()
+    inputs = opt_tokenizer(PROMPTS, padding=True, return_tensors="pt")[
+        "input_ids"
+    ].cuda()
+
+    # Reference activations, copied synchronously by plain Pytorch hooks.
+    ground_truth = {}
+    model.get_submodule(MODULE_NAME_1).register_forward_hook(
+        lambda m, i, o: ground_truth.update(forward=o.detach().cpu())
+    )
+    model.get_submodule(MODULE_NAME_2).register_full_backward_hook(
+        lambda m, gi, go: ground_truth.update(backward=gi[0].detach().cpu())
+    )
+
+    activations = {}
+    model = FlexModel(model, activations, async_offload=True)
+    assert model._offload_stream is not None
+
+    model.register_forward_hook(
+        HookFunction(MODULE_NAME_1, expected_shape=(None, None, None))
+    )
+    model.register_full_backward_hook(
+        HookFunction(MODULE_NAME_2, expected_shape=(None, None, None))
+    )
+
+    # Forward activations are readable as soon as the forward pass returns.
+    outputs = model(inputs)
+    assert torch.equal(activations[MODULE_NAME_1][0], ground_truth["forward"])
+
+    # Backward activations are readable as soon as the backward pass returns.
+    outputs.logits.sum().backward()
+    assert torch.equal(activations[MODULE_NAME_2][0], ground_truth["backward"])
@@ -1,7 +1,15 @@
 import torch
 from transformers.modeling_outputs import BaseModelOutputWithPast
 
-from flex_model.traverse.nodes import BaseModelOutputWithPastNode
+from flex_model.traverse.nodes import (
+    BaseModelOutputWithPastNode,
+    InternalNode,
+    ListNode,
+    TensorNode,
+    TupleNode,
+    register_internal_node_type,
+)
+from flex_model.traverse.ops import flatten, unflatten
 
 
 def test_BaseModelOutputWithPastNode():
@@ -22,3 +30,55 @@ def test_BaseModelOutputWithPastNode():
     assert torch.equal(new_obj.past_key_values, obj.past_key_values)
     assert torch.equal(new_obj.hidden_states, obj.hidden_states)
     assert torch.equal(new_obj.attentions, obj.attentions)
+
+
+def test_InternalNode_eq():
+    def _make_treedef(leaf_shape, scalar):
+        return TupleNode(
+            children=[
+                TensorNode(val=leaf_shape),
+                ListNode(children=[scalar, TensorNode(val=leaf_shape)]),
+            ]
+        )
+
+    treedef = _make_treedef(torch.Size([1]), "a")
+
+    assert treedef == _make_treedef(torch.Size([1]), "a")
+
+    # Mismatched scalars.
+    assert not treedef == _make_treedef(torch.Size([1]), "b")
+
+    # Mismatched node types.
+    assert not treedef == ListNode(children=treedef.children)
+
+    # Mismatched number of children.
+    assert not treedef == TupleNode(children=treedef.children[:1])
+    assert not treedef == TupleNode(children=[*treedef.children, "c"])
+
+
+def test_register_internal_node_type_instance_method_flatten():
+    class Pair:
+        def __init__(self, first, second):
+            self.first = first
+            self.second = second
+
+    @register_internal_node_type(Pair)
+    class PairNode(InternalNode):
+        def flatten(self, instance):
+            return (instance.first, instance.second)
+
+        def unflatten(self, children):
+            return Pair(*children)
+
+    obj = Pair(torch.ones((1)), (torch.ones((1)) * 2, "a"))
+    contents = PairNode.flatten(obj)
+    assert contents == (obj.first, obj.second)
+    assert PairNode().flatten(obj) == contents
+
+    treedef, leaves = flatten(obj)
+    assert len(leaves) == 2
+
+    new_obj = unflatten(treedef, leaves)
+    assert type(new_obj) is Pair
+    assert new_obj.first is obj.first
+    assert new_obj.second[0] is leaves[1] and new_obj.second[1] == "a"
@@ -21,3 +21,66 @@ def test_flatten_and_unflatten():
     new_treedef, new_leaves = flatten(result)
     assert new_treedef == treedef
     assert new_leaves == edited_leaves
+
+
+def test_flatten_and_unflatten_deeply_nested():
+    # Nesting deeper than the python recursion limit.
+    layer_output = torch.ones((1))
+    for _ in range(5000):
+        layer_output = (layer_output,)
+
+    treedef, leaves = flatten(layer_output)
+    assert len(leaves) == 1
+
+    result = unflatten(treedef, leaves)
+    new_treedef, new_leaves = flatten(result)
+    assert new_treedef == treedef
+    assert new_leaves[0] is leaves[0]
+
+
+def test_flatten_treedef_cache():
+    def _make_layer_output(scalar):
+        return (torch.ones((2, 3)), [scalar, (torch.ones((2, 3)),)])
+
+    treedef, _ = flatten(_make_layer_output(1))
+
+    # Structurally identical objects share a tree definition.
+    new_treedef, _ = flatten(_make_layer_output(1))
+    assert new_treedef is treedef
+
+    # Scalars are part of the structure.
+    for scalar in [2, True, "1"]:
+        new_treedef, new_leaves = flatten(_make_layer_output(scalar))
+        assert new_treedef is not treedef
+        assert unflatten(new_treedef, new_leaves)[1][0] is scalar
+
+    # Arbitrary scalar objects are never cached.
+    scalar = {"a": 1}
+    new_treedef, new_leaves = flatten(_make_layer_output(scalar))
+    assert unflatten(new_treedef, new_leaves)[1][0] is scalar
+    assert flatten(_make_layer_output(scalar))[0] is not new_treedef
+
+
+def test_flatten_tuple_of_tensors():
+    past_key_values = tuple(
+        (torch.ones((2, 3)) * i, torch.ones((2, 3)) * -i) for i in range(4)
+    )
+    layer_output = (torch.ones((2, 3)),) + past_key_values
+
+    treedef, leaves = flatten(layer_output)
+    assert len(leaves) == 9
+
+    # Matches the tree definition built by the generic traversal.
+    generic_treedef, generic_leaves = flatten([layer_output])
+    assert generic_treedef.children[0] == treedef
+    assert all(a is b for a, b in zip(leaves, generic_leaves))
+
+    result = unflatten(treedef, leaves)
+    assert type(result) is tuple
+    assert all(type(kv) is tuple for kv in result[1:])
+    assert all(a is b for a, b in zip(flatten(result)[1], leaves))
+
+    # Anything else falls back to the generic traversal.
+    treedef, leaves = flatten(layer_output + (None,))
+    assert len(leaves) == 9
+    assert unflatten(treedef, leaves)[-1] is None